@@ -11,19 +11,15 @@ Input data can be given as one or multiple of:
 -a summary file generated by albacore
 """
 
-from os import path
+from os import path, cpu_count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import chain
 import logging
-import nanomath
-import numpy as np
-from scipy import stats
+import multiprocessing
 import nanoplot.utils as utils
-import nanoplot.report as report
-from nanoget import get_input
 from nanoplot.filteroptions import filter_and_transform_data
 from nanoplot.version import __version__
-from nanoplotter.plot import Plot
-import nanoplotter
-import pickle
 import sys
 
 
@@ -40,7 +36,14 @@ def main():
         utils.init_logs(args)
         # args.format = nanoplotter.check_valid_format(args.format)
         if args.pickle:
-            datadf = pickle.load(open(args.pickle, "rb"))
+            if args.pickle.endswith(".parquet"):
+                from pandas import read_parquet
+
+                datadf = read_parquet(args.pickle)
+            else:
+                import pickle
+
+                datadf = pickle.load(open(args.pickle, "rb"))
         elif args.feather:
             from nanoget import combine_dfs
             from pandas import read_feather
@@ -59,22 +62,41 @@ def main():
                 "fasta": args.fasta,
                 "ubam": args.ubam,
             }
-            datadf = get_input(
-                source=[n for n, s in sources.items() if s][0],
-                files=[f for f in sources.values() if f][0],
-                threads=args.threads,
+            source = [n for n, s in sources.items() if s][0]
+            files = [f for f in sources.values() if f][0]
+            options = dict(
                 readtype=args.readtype,
-                combine="simple",
                 barcoded=args.barcoded,
                 huge=args.huge,
                 keep_supp=not (args.no_supplementary),
             )
+            if args.no_cache:
+                cachefile = None
+            else:
+                cachefile = utils.cache_path(args.outdir, source, files, **options)
+            if cachefile and path.isfile(cachefile):
+                from pandas import read_parquet
+
+                logging.info(f"Using data cached in {cachefile}")
+                datadf = read_parquet(cachefile, engine="pyarrow")
+            else:
+                from nanoget import get_input
+
+                datadf = get_input(
+                    source=source,
+                    files=files,
+                    threads=args.threads,
+                    combine="simple",
+                    **options,
+                )
+                if cachefile:
+                    utils.write_cache(datadf, cachefile)
         if args.store:
-            pickle.dump(obj=datadf, file=open(settings["path"] + "NanoPlot-data.pickle", "wb"))
+            datadf.to_parquet(settings["path"] + "NanoPlot-data.parquet", compression="zstd")
         if args.raw:
-            datadf.to_csv(
-                settings["path"] + "NanoPlot-data.tsv.gz", sep="\t", index=False, compression="gzip"
-            )
+            utils.write_tsv_gz(datadf, settings["path"] + "NanoPlot-data.tsv.gz", args.threads)
+        # narrowed for filtering and plotting only, the exports above keep the extracted precision
+        datadf = utils.reduce_memory_usage(datadf, keep_precision=args.keep_float64)
 
         settings["statsfile"] = [make_stats(datadf, settings, suffix="", tsv_stats=args.tsv_stats)]
         datadf, settings = filter_and_transform_data(datadf, settings)
@@ -88,18 +110,24 @@ def main():
                 )
             )
 
+        settings = check_plot_settings(settings)
         if args.only_report:
-                Plot.only_report = True
-                
+            from nanoplotter.plot import Plot
+
+            Plot.only_report = True
+
         if args.barcoded:
+            from nanoplot.report import BarcodeTitle
+
             main_path = settings["path"]
-            for barc in list(datadf["barcode"].unique()):
-                dfbarc = datadf[datadf["barcode"] == barc]
+            barcode_rows = datadf.groupby("barcode", sort=False, observed=True).indices
+            for barc, rows in barcode_rows.items():
+                dfbarc = datadf.iloc[rows]
                 if len(dfbarc) > 5:
                     logging.info(f"Processing {barc}")
                     settings["title"] = barc
                     settings["path"] = path.join(args.outdir, args.prefix + barc + "_")
-                    plots = [report.BarcodeTitle(barc)]
+                    plots = [BarcodeTitle(barc)]
                     plots.extend(make_plots(dfbarc, settings))
                     make_report(plots, settings)
                 else:
@@ -121,14 +149,17 @@ def main():
 
 
 def make_stats(datadf, settings, suffix, tsv_stats=True):
+    import nanomath
+
     statsfile = settings["path"] + "NanoStats" + suffix + ".txt"
     stats_df = nanomath.write_stats(datadfs=[datadf], outputfile=statsfile, as_tsv=tsv_stats)
     logging.info("Calculated statistics")
     if settings["barcoded"]:
-        barcodes = list(datadf["barcode"].unique())
+        barcode_rows = datadf.groupby("barcode", sort=False, observed=True).indices
+        barcodes = list(barcode_rows)
         statsfile = settings["path"] + "NanoStats_barcoded.txt"
         stats_df = nanomath.write_stats(
-            datadfs=[datadf[datadf["barcode"] == b] for b in barcodes],
+            datadfs=[datadf.iloc[barcode_rows[b]] for b in barcodes],
             outputfile=statsfile,
             names=barcodes,
             as_tsv=tsv_stats,
@@ -136,35 +167,80 @@ def make_stats(datadf, settings, suffix, tsv_stats=True):
     return stats_df if tsv_stats else statsfile
 
 
-def make_plots(datadf, settings):
+def check_plot_settings(settings):
     """
-    Call plotting functions from nanoplotter
-    settings["lengths_pointer"] is a column in the DataFrame specifying which lengths to use
+    Validate the options shared by all plots, once per run rather than per barcode
     """
-    color = nanoplotter.check_valid_color(settings["color"])
-    colormap = nanoplotter.check_valid_colormap(settings["colormap"])
+    import nanoplotter
+
+    settings["color"] = nanoplotter.check_valid_color(settings["color"])
+    settings["colormap"] = nanoplotter.check_valid_colormap(settings["colormap"])
 
-    plotdict = {type: settings["plots"].count(type) for type in ["kde", "hex", "dot", "pauvre"]}
+    settings["plotdict"] = {
+        type: settings["plots"].count(type) for type in ["kde", "hex", "dot", "pauvre"]
+    }
     if "hex" in settings["plots"]:
         print(
             "WARNING: hex as part of --plots has been deprecated and will be ignored. To get the hex output, rerun with --legacy hex."
         )
 
     if settings["legacy"]:
-        plotdict_legacy = {plot: settings["legacy"].count(plot) for plot in ["kde", "hex", "dot"]}
+        settings["plotdict_legacy"] = {
+            plot: settings["legacy"].count(plot) for plot in ["kde", "hex", "dot"]
+        }
     else:
-        plotdict_legacy = {}
-    plots = []
+        settings["plotdict_legacy"] = {}
+    return settings
 
-    subdf = utils.subsample_datasets(datadf)
-    if settings["N50"]:
-        n50 = nanomath.get_N50(np.sort(datadf["lengths"]))
-    else:
-        n50 = None
 
-    plots.extend(
-        nanoplotter.length_plots(
-            array=datadf[datadf["length_filter"]]["lengths"].astype("uint64"),
+def make_plots(datadf, settings):
+    """
+    Call plotting functions from nanoplotter
+    settings["lengths_pointer"] is a column in the DataFrame specifying which lengths to use
+    """
+    import numpy as np
+    import nanoplotter
+
+    color = settings["color"]
+    colormap = settings["colormap"]
+    plotdict = settings["plotdict"]
+    plotdict_legacy = settings["plotdict_legacy"]
+
+    # columns are converted to numpy once and shared by all plots using them
+    columns = {
+        col: datadf[col].to_numpy()
+        for col in [
+            "lengths",
+            "aligned_lengths",
+            "log_lengths",
+            "log_aligned_lengths",
+            "quals",
+            "aligned_quals",
+            "mapQ",
+            "percentIdentity",
+            "channelIDs",
+        ]
+        if col in datadf
+    }
+
+    # np.partition releases the GIL, so the N50 is found while the other data is prepared
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        if settings["N50"]:
+            n50_future = executor.submit(utils.get_N50, columns["lengths"])
+        subdf = utils.subsample_datasets(datadf)
+        length_filter = datadf["length_filter"].to_numpy()
+        if length_filter.all():
+            filtered = columns  # no reads hidden from the length plots, so nothing to copy
+        else:
+            filtered = {col: values[length_filter] for col, values in columns.items()}
+        lengths = filtered["lengths"].astype("uint64")
+    n50 = n50_future.result() if settings["N50"] else None
+
+    jobs = []
+    jobs.append(
+        partial(
+            nanoplotter.length_plots,
+            array=lengths,
             name="Read length",
             path=settings["path"],
             n50=n50,
@@ -173,12 +249,12 @@ def make_plots(datadf, settings):
             settings=settings,
         )
     )
-    logging.info("Created length plots")
     if "quals" in datadf:
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]][settings["lengths_pointer"].replace("log_", "")],
-                y=datadf[datadf["length_filter"]]["quals"],
+        jobs.append(
+            partial(
+                nanoplotter.scatter,
+                x=filtered[settings["lengths_pointer"].replace("log_", "")],
+                y=filtered["quals"],
                 legacy=plotdict_legacy,
                 names=["Read lengths", "Average read quality"],
                 path=settings["path"] + "LengthvsQualityScatterPlot",
@@ -190,10 +266,11 @@ def make_plots(datadf, settings):
             )
         )
         if settings["logBool"]:
-            plots.extend(
-                nanoplotter.scatter(
-                    x=datadf[datadf["length_filter"]][settings["lengths_pointer"]],
-                    y=datadf[datadf["length_filter"]]["quals"],
+            jobs.append(
+                partial(
+                    nanoplotter.scatter,
+                    x=filtered[settings["lengths_pointer"]],
+                    y=filtered["quals"],
                     legacy=plotdict_legacy,
                     names=["Read lengths", "Average read quality"],
                     path=settings["path"] + "LengthvsQualityScatterPlot",
@@ -205,21 +282,22 @@ def make_plots(datadf, settings):
                     settings=settings,
                 )
             )
-        logging.info("Created LengthvsQual plot")
     if "channelIDs" in datadf:
-        plots.extend(
-            nanoplotter.spatial_heatmap(
-                array=datadf["channelIDs"],
+        jobs.append(
+            partial(
+                nanoplotter.spatial_heatmap,
+                array=None,
+                counts=np.bincount(columns["channelIDs"].astype(np.intp, copy=False)),
                 title=settings["title"],
                 path=settings["path"] + "ActivityMap_ReadsPerChannel",
                 colormap=colormap,
                 settings=settings,
             )
         )
-        logging.info("Created spatialheatmap for succesfull basecalls.")
     if "start_time" in datadf:
-        plots.extend(
-            nanoplotter.time_plots(
+        jobs.append(
+            partial(
+                nanoplotter.time_plots,
                 df=datadf,
                 subsampled_df=subdf,
                 path=settings["path"],
@@ -229,8 +307,9 @@ def make_plots(datadf, settings):
             )
         )
         if settings["logBool"]:
-            plots.extend(
-                nanoplotter.time_plots(
+            jobs.append(
+                partial(
+                    nanoplotter.time_plots,
                     df=datadf,
                     subsampled_df=subdf,
                     path=settings["path"],
@@ -240,12 +319,12 @@ def make_plots(datadf, settings):
                     settings=settings,
                 )
             )
-        logging.info("Created timeplots.")
     if "aligned_lengths" in datadf and "lengths" in datadf:
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]]["aligned_lengths"],
-                y=datadf[datadf["length_filter"]]["lengths"],
+        jobs.append(
+            partial(
+                nanoplotter.scatter,
+                x=filtered["aligned_lengths"],
+                y=filtered["lengths"],
                 legacy=plotdict_legacy,
                 names=["Aligned read lengths", "Sequenced read length"],
                 path=settings["path"] + "AlignedReadlengthvsSequencedReadLength",
@@ -256,12 +335,12 @@ def make_plots(datadf, settings):
                 settings=settings,
             )
         )
-        logging.info("Created AlignedLength vs Length plot.")
     if "mapQ" in datadf and "quals" in datadf:
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf["mapQ"],
-                y=datadf["quals"],
+        jobs.append(
+            partial(
+                nanoplotter.scatter,
+                x=columns["mapQ"],
+                y=columns["quals"],
                 legacy=plotdict_legacy,
                 names=["Read mapping quality", "Average basecall quality"],
                 path=settings["path"] + "MappingQualityvsAverageBaseQuality",
@@ -272,11 +351,11 @@ def make_plots(datadf, settings):
                 settings=settings,
             )
         )
-        logging.info("Created MapQvsBaseQ plot.")
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]][settings["lengths_pointer"].replace("log_", "")],
-                y=datadf[datadf["length_filter"]]["mapQ"],
+        jobs.append(
+            partial(
+                nanoplotter.scatter,
+                x=filtered[settings["lengths_pointer"].replace("log_", "")],
+                y=filtered["mapQ"],
                 legacy=plotdict_legacy,
                 names=["Read length", "Read mapping quality"],
                 path=settings["path"] + "MappingQualityvsReadLength",
@@ -288,10 +367,11 @@ def make_plots(datadf, settings):
             )
         )
         if settings["logBool"]:
-            plots.extend(
-                nanoplotter.scatter(
-                    x=datadf[datadf["length_filter"]][settings["lengths_pointer"]],
-                    y=datadf[datadf["length_filter"]]["mapQ"],
+            jobs.append(
+                partial(
+                    nanoplotter.scatter,
+                    x=filtered[settings["lengths_pointer"]],
+                    y=filtered["mapQ"],
                     legacy=plotdict_legacy,
                     names=["Read length", "Read mapping quality"],
                     path=settings["path"] + "MappingQualityvsReadLength",
@@ -303,65 +383,66 @@ def make_plots(datadf, settings):
                     settings=settings,
                 )
             )
-        logging.info("Created Mapping quality vs read length plot.")
     if "percentIdentity" in datadf:
-        minPID = np.percentile(datadf["percentIdentity"], 1)
+        minPID = utils.lower_percentile(columns["percentIdentity"], 1)
         if "aligned_quals" in datadf:
-            plots.extend(
-                nanoplotter.scatter(
-                    x=datadf["percentIdentity"],
-                    y=datadf["aligned_quals"],
+            jobs.append(
+                partial(
+                    nanoplotter.scatter,
+                    x=columns["percentIdentity"],
+                    y=columns["aligned_quals"],
                     legacy=plotdict_legacy,
                     names=["Percent identity", "Average Base Quality"],
                     path=settings["path"] + "PercentIdentityvsAverageBaseQuality",
                     color=color,
                     colormap=colormap,
                     plots=plotdict,
-                    stat=stats.pearsonr if not settings["hide_stats"] else None,
+                    stat=utils.pearsonr if not settings["hide_stats"] else None,
                     minvalx=minPID,
                     title=settings["title"],
                     settings=settings,
                 )
             )
-            logging.info("Created Percent ID vs Base quality plot.")
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]][settings["lengths_pointer"].replace("log_", "")],
-                y=datadf[datadf["length_filter"]]["percentIdentity"],
+        jobs.append(
+            partial(
+                nanoplotter.scatter,
+                x=filtered[settings["lengths_pointer"].replace("log_", "")],
+                y=filtered["percentIdentity"],
                 legacy=plotdict_legacy,
                 names=["Aligned read length", "Percent identity"],
                 path=settings["path"] + "PercentIdentityvsAlignedReadLength",
                 color=color,
                 colormap=colormap,
                 plots=plotdict,
-                stat=stats.pearsonr if not settings["hide_stats"] else None,
+                stat=utils.pearsonr if not settings["hide_stats"] else None,
                 minvaly=minPID,
                 title=settings["title"],
                 settings=settings,
             )
         )
         if settings["logBool"]:
-            plots.extend(
-                nanoplotter.scatter(
-                    x=datadf[datadf["length_filter"]][settings["lengths_pointer"]],
-                    y=datadf[datadf["length_filter"]]["percentIdentity"],
+            jobs.append(
+                partial(
+                    nanoplotter.scatter,
+                    x=filtered[settings["lengths_pointer"]],
+                    y=filtered["percentIdentity"],
                     legacy=plotdict_legacy,
                     names=["Aligned read length", "Percent identity"],
                     path=settings["path"] + "PercentIdentityvsAlignedReadLength",
                     color=color,
                     colormap=colormap,
                     plots=plotdict,
-                    stat=stats.pearsonr if not settings["hide_stats"] else None,
+                    stat=utils.pearsonr if not settings["hide_stats"] else None,
                     log=True,
                     minvaly=minPID,
                     title=settings["title"],
                     settings=settings,
                 )
             )
-
-        plots.append(
-            nanoplotter.dynamic_histogram(
-                array=datadf["percentIdentity"],
+        jobs.append(
+            partial(
+                nanoplotter.dynamic_histogram,
+                array=columns["percentIdentity"],
                 name="percent identity",
                 path=settings["path"] + "PercentIdentityHistogram",
                 title=settings["title"],
@@ -369,10 +450,57 @@ def make_plots(datadf, settings):
                 settings=settings,
             )
         )
-        logging.info("Created Percent ID vs Length plot")
+    if plotdict["kde"]:
+        # slow to import, so loaded once here rather than by every forked plotting process
+        import plotly.figure_factory  # noqa: F401
+    # matplotlib figures of --legacy plots are not passed between processes
+    return run_plot_jobs(jobs, threads=1 if settings["legacy"] else settings["threads"])
+
+
+# plotting jobs of the running pool, inherited by its forked workers rather than pickled to them
+plot_jobs = []
+
+
+def run_plot_jobs(jobs, threads=1):
+    """
+    Run the independent plotting jobs, in up to that many forked processes on linux
+    Few jobs or a single core are not worth forking for, and run in this process
+    Returns the plots in the order of the jobs
+    """
+    workers = min(threads, len(jobs), cpu_count() or 1)
+    if sys.platform.startswith("linux") and workers > 1 and len(jobs) >= 4:
+        import numpy as np
+
+        plot_jobs[:] = jobs  # set before the workers are forked, which only receive an index
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=np.random.seed,  # forked processes would share the parent's random state
+            ) as executor:
+                results = list(executor.map(run_plot_job, range(len(jobs))))
+        finally:
+            plot_jobs.clear()
+    else:
+        results = [job() for job in jobs]
+    plots = []
+    for result in results:
+        plots.extend(result if isinstance(result, list) else [result])
     return plots
 
 
+def run_plot_job(index):
+    """
+    Run a plotting job in a worker process
+    The plots are saved already, so the plotly figures are dropped rather than sent back
+    """
+    result = plot_jobs[index]()
+    for plot in result if isinstance(result, list) else [result]:
+        if plot.html:
+            plot.fig = None
+    return result
+
+
 def make_report(plots, settings):
     """
     Creates a fat html report based on the previously created files
@@ -380,18 +508,27 @@ def make_report(plots, settings):
     statsfile is the file to which the stats have been saved,
     which is parsed to a table (rather dodgy) or nicely if it's a pandas/tsv
     """
+    import nanoplot.report as report
+
     logging.info("Writing html report.")
 
-    html_content = [
-        '<body class="grid">',
-        report.html_toc(plots, filtered=settings["filtered"]),
-        report.html_stats(settings),
+    html_content = chain(
+        [
+            report.html_head,
+            '<body class="grid">',
+            report.html_toc(plots, filtered=settings["filtered"]),
+            report.html_stats(settings),
+        ],
         report.html_plots(plots),
-        report.run_info(settings) if settings["info_in_report"] else "",
-        "</main></body></html>",
-    ]
-    with open(settings["path"] + "NanoPlot-report.html", "w") as html_file:
-        html_file.write(report.html_head + "\n".join(html_content))
+        [
+            report.run_info(settings) if settings["info_in_report"] else "",
+            "</main></body></html>",
+        ],
+    )
+    with open(settings["path"] + "NanoPlot-report.html", "wb", buffering=1 << 20) as html_file:
+        for part in html_content:
+            html_file.write(part.encode("utf-8"))
+            html_file.write(b"\n")
 
 
 if __name__ == "__main__":
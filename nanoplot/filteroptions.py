@@ -2,21 +2,34 @@ import logging
 import numpy as np
 from datetime import timedelta
 import sys
-
-
-def flag_length_outliers(df, columnname):
-    """Return index of records with length-outliers above 3 standard deviations from the median."""
-    return df[columnname] > (np.median(df[columnname]) + 3 * np.std(df[columnname]))
+from nanoplot.utils import sample_rows
+
+# columns read by the stats and the plots, others are not carried along by filtering
+USED_COLUMNS = [
+    "readIDs",
+    "lengths",
+    "aligned_lengths",
+    "quals",
+    "aligned_quals",
+    "mapQ",
+    "percentIdentity",
+    "channelIDs",
+    "start_time",
+    "duration",
+    "barcode",
+    "dataset",
+]
+
+
+def flag_length_outliers(lengths):
+    """Return mask of length-outliers above 3 standard deviations from the median."""
+    return lengths > (np.median(lengths) + 3 * np.std(lengths))
 
 
 def phred_to_percent(phred):
     return 100 * (1 - 10 ** (phred / -10))
 
 
-def non_filtered_reads(df):
-    return len(df[df["length_filter"]])
-
-
 def filter_and_transform_data(df, settings):
     """
     Perform filtering on the data based on arguments set on commandline
@@ -33,9 +46,12 @@ def filter_and_transform_data(df, settings):
 
     * using a boolean column length_filter
     """
-    df["length_filter"] = True
     settings["filtered"] = False
 
+    unused = [col for col in df if col not in USED_COLUMNS]
+    if unused:
+        df = df.drop(columns=unused)
+
     if settings.get("alength") and settings.get("bam"):
         settings["lengths_pointer"] = "aligned_lengths"
         logging.info("Using aligned read lengths for plotting.")
@@ -43,10 +59,14 @@ def filter_and_transform_data(df, settings):
         settings["lengths_pointer"] = "lengths"
         logging.info("Using sequenced read lengths for plotting.")
 
+    # reads hidden from plots involving length
+    lengths = df[settings["lengths_pointer"]].to_numpy()
+    length_filter = np.ones(len(df), dtype=bool)
+
     if settings.get("drop_outliers"):
-        num_reads_prior = non_filtered_reads(df)
-        df.loc[flag_length_outliers(df, settings["lengths_pointer"]), "length_filter"] = False
-        num_reads_post = non_filtered_reads(df)
+        num_reads_prior = np.count_nonzero(length_filter)
+        length_filter &= ~flag_length_outliers(lengths)
+        num_reads_post = np.count_nonzero(length_filter)
         logging.info(
             "Hidding {} length outliers in length plots.".format(
                 str(num_reads_prior - num_reads_post)
@@ -54,9 +74,9 @@ def filter_and_transform_data(df, settings):
         )
 
     if settings.get("maxlength"):
-        num_reads_prior = non_filtered_reads(df)
-        df.loc[df[settings["lengths_pointer"]] > settings["maxlength"], "length_filter"] = False
-        num_reads_post = non_filtered_reads(df)
+        num_reads_prior = np.count_nonzero(length_filter)
+        length_filter &= lengths <= settings["maxlength"]
+        num_reads_post = np.count_nonzero(length_filter)
         logging.info(
             "Hidding {} reads longer than {}bp in length plots.".format(
                 str(num_reads_prior - num_reads_post), str(settings["maxlength"])
@@ -64,20 +84,24 @@ def filter_and_transform_data(df, settings):
         )
 
     if settings.get("minlength"):
-        num_reads_prior = non_filtered_reads(df)
-        df.loc[df[settings["lengths_pointer"]] < settings["minlength"], "length_filter"] = False
-        num_reads_post = non_filtered_reads(df)
+        num_reads_prior = np.count_nonzero(length_filter)
+        length_filter &= lengths >= settings["minlength"]
+        num_reads_post = np.count_nonzero(length_filter)
         logging.info(
             "Hidding {} reads shorter than {}bp in length plots.".format(
                 str(num_reads_prior - num_reads_post), str(settings["minlength"])
             )
         )
+    df["length_filter"] = length_filter
+
+    # reads removed from the dataset altogether, dropped in a single copy
+    keep = np.ones(len(df), dtype=bool)
 
     if settings.get("minqual"):
         if "quals" in df:
-            num_reads_prior = non_filtered_reads(df)
-            df = df.loc[df["quals"] > settings["minqual"]].copy()
-            num_reads_post = non_filtered_reads(df)
+            num_reads_prior = np.count_nonzero(keep)
+            keep &= df["quals"].to_numpy() > settings["minqual"]
+            num_reads_post = np.count_nonzero(keep)
             logging.info(
                 "Removing {} reads with quality below Q{}.".format(
                     str(num_reads_prior - num_reads_post), str(settings["minqual"])
@@ -88,19 +112,11 @@ def filter_and_transform_data(df, settings):
             sys.stderr.write("--minqual is ignored since no quality information in the data.")
             logging.info("--minqual is ignored since no quality information in the data.")
 
-    if settings.get("loglength"):
-        df["log_" + settings["lengths_pointer"]] = np.log10(df[settings["lengths_pointer"]])
-        settings["lengths_pointer"] = "log_" + settings["lengths_pointer"]
-        logging.info("Using log10 scaled read lengths.")
-        settings["logBool"] = True
-    else:
-        settings["logBool"] = False
-
     if settings.get("runtime_until"):
         if "start_time" in df:
-            num_reads_prior = non_filtered_reads(df)
-            df = df[df.start_time < timedelta(hours=settings["runtime_until"])]
-            num_reads_post = non_filtered_reads(df)
+            num_reads_prior = np.count_nonzero(keep)
+            keep &= (df["start_time"] < timedelta(hours=settings["runtime_until"])).to_numpy()
+            num_reads_post = np.count_nonzero(keep)
             logging.info(
                 "Removing {} reads generated after {} hours in the run.".format(
                     str(num_reads_prior - num_reads_post), str(settings["runtime_until"])
@@ -112,9 +128,9 @@ def filter_and_transform_data(df, settings):
             logging.info("--runtime_until is ignored since no time information in the data.")
 
     if "quals" in df:
-        num_reads_prior = len(df)
-        df = df.loc[-((df["lengths"] < 20) & (df["quals"] > 30))].copy()
-        num_reads_post = len(df)
+        num_reads_prior = np.count_nonzero(keep)
+        keep &= ~((df["lengths"].to_numpy() < 20) & (df["quals"].to_numpy() > 30))
+        num_reads_post = np.count_nonzero(keep)
         if num_reads_prior - num_reads_post > 0:
             logging.info(
                 "Removed {} artefactual reads with very short length and very high quality.".format(
@@ -123,10 +139,24 @@ def filter_and_transform_data(df, settings):
             )
             settings["filtered"] = True
 
+    if not keep.all():
+        df = df.loc[keep].copy()
+
+    if settings.get("loglength"):
+        lengths = df[settings["lengths_pointer"]].to_numpy()
+        # float32 is plenty precise for plotting and halves the size of the column
+        dtype = np.float32 if lengths.size and lengths.max() < 1e7 else np.float64
+        df["log_" + settings["lengths_pointer"]] = np.log10(lengths, dtype=dtype)
+        settings["lengths_pointer"] = "log_" + settings["lengths_pointer"]
+        logging.info("Using log10 scaled read lengths.")
+        settings["logBool"] = True
+    else:
+        settings["logBool"] = False
+
     if settings.get("downsample"):
         new_size = min(settings["downsample"], len(df))
         logging.info("Downsampling the dataset from {} to {} reads".format(len(df), new_size))
-        df = df.sample(new_size)
+        df = sample_rows(df, new_size)
         settings["filtered"] = True
 
     if settings.get("percentqual"):
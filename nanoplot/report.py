@@ -82,19 +82,20 @@ def html_toc(plots, filtered=False):
 
 
 def html_plots(plots):
-    html_plots = []
-    html_plots.append('<h3 id="plots">Plots</h3>')
-    for plot in plots:
-        html_plots.append('<button class="collapsible">' + plot.title + '</button>')
-        html_plots.append('<section class="collapsible-content"><h4 class="hiddentitle" id="' +
-                          plot.title.replace(' ', '_') + '">' + plot.title + '</h4>')
-        html_plots.append(plot.encode())
-        html_plots.append('</section>')
+    """Yield the html of the plots section one fragment at a time.
 
-    html_plots.append(
-        '<script>var coll = document.getElementsByClassName("collapsible");var i;for (i = 0; i < coll.length; i++) {coll[i].addEventListener("click", function() {this.classList.toggle("active");var content = this.nextElementSibling;if (content.style.display === "none") {content.style.display = "block";} else {content.style.display = "none";}});}</script>')
+    Plots are encoded only when their fragment is requested, so the report can be
+    written out without holding every encoded plot in memory at once.
+    """
+    yield '<h3 id="plots">Plots</h3>'
+    for plot in plots:
+        yield '<button class="collapsible">' + plot.title + '</button>'
+        yield ('<section class="collapsible-content"><h4 class="hiddentitle" id="' +
+               plot.title.replace(' ', '_') + '">' + plot.title + '</h4>')
+        yield plot.encode()
+        yield '</section>'
 
-    return '\n'.join(html_plots)
+    yield '<script>var coll = document.getElementsByClassName("collapsible");var i;for (i = 0; i < coll.length; i++) {coll[i].addEventListener("click", function() {this.classList.toggle("active");var content = this.nextElementSibling;if (content.style.display === "none") {content.style.display = "block";} else {content.style.display = "none";}});}</script>'
 
 
 def run_info(settings):
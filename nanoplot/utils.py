@@ -1,12 +1,17 @@
 import sys
 import os
+import hashlib
+import io
+import shutil
+import subprocess
+import tempfile
 from datetime import datetime as dt
 from time import time
 import logging
 from nanoplot.version import __version__
 from argparse import HelpFormatter, Action, ArgumentParser
 import textwrap as _textwrap
-import pandas as pd
+import numpy as np
 
 
 class CustomHelpFormatter(HelpFormatter):
@@ -46,6 +51,10 @@ class Action_Print_Colormaps(Action):
 
 
 def get_args():
+    # answer --version without building the parser
+    if len(sys.argv) == 2 and sys.argv[1] in ["-v", "--version"]:
+        print("NanoPlot {}".format(__version__))
+        sys.exit(0)
     epilog = """EXAMPLES:
     NanoPlot --summary sequencing_summary.txt --loglength -o summary-plots-log-transformed
     NanoPlot -t 2 --fastq reads1.fastq.gz reads2.fastq.gz --maxlength 40000 --plots hex dot
@@ -69,8 +78,9 @@ def get_args():
     general.add_argument(
         "-t",
         "--threads",
-        help="Set the allowed number of threads to be used by the script",
-        default=4,
+        help="Set the allowed number of threads to be used by the script "
+        "(default: half of the available cores, at least 4)",
+        default=max(4, (os.cpu_count() or 1) // 2),
         type=int,
     )
     general.add_argument(
@@ -78,13 +88,23 @@ def get_args():
     )
     general.add_argument(
         "--store",
-        help="Store the extracted data in a pickle file for future plotting.",
+        help="Store the extracted data in a parquet file for future plotting.",
         action="store_true",
     )
     general.add_argument(
         "--raw", help="Store the extracted data in tab separated file.", action="store_true"
     )
     general.add_argument("--huge", help="Input data is one very large file.", action="store_true")
+    general.add_argument(
+        "--no_cache",
+        help="Do not cache the extracted data in the output directory for later runs.",
+        action="store_true",
+    )
+    general.add_argument(
+        "--keep_float64",
+        help="Keep the extracted metrics at full precision rather than narrowing them.",
+        action="store_true",
+    )
     general.add_argument(
         "-o", "--outdir", help="Specify directory in which output has to be created.", default="."
     )
@@ -277,7 +297,11 @@ def get_args():
     mtarget.add_argument(
         "--cram", help="Data is in one or more sorted cram file(s).", nargs="+", metavar="file"
     )
-    mtarget.add_argument("--pickle", help="Data is a pickle file stored earlier.", metavar="pickle")
+    mtarget.add_argument(
+        "--pickle",
+        help="Data is a parquet (or legacy pickle) file stored earlier.",
+        metavar="pickle",
+    )
     mtarget.add_argument(
         "--feather",
         "--arrow",
@@ -345,7 +369,20 @@ def init_logs(args, tool="NanoPlot"):
     return logname
 
 
+def sample_rows(df, n):
+    """Return n randomly chosen rows of df, in their original order.
+
+    Draws from a PCG64 generator rather than pandas' legacy RandomState, and gathers
+    the rows at sorted positions so memory is read sequentially.
+    """
+    rows = np.random.default_rng().choice(len(df), size=n, replace=False, shuffle=False)
+    rows.sort()
+    return df.take(rows)
+
+
 def subsample_datasets(df, minimal=10000):
+    import pandas as pd
+
     if "dataset" in df:
         list_df = []
 
@@ -356,7 +393,7 @@ def subsample_datasets(df, minimal=10000):
                 list_df.append(dataset)
 
             else:
-                list_df.append(dataset.sample(minimal))
+                list_df.append(sample_rows(dataset, minimal))
 
         subsampled_df = pd.concat(list_df, ignore_index=True)
 
@@ -365,6 +402,145 @@ def subsample_datasets(df, minimal=10000):
             subsampled_df = df
 
         else:
-            subsampled_df = df.sample(minimal)
+            subsampled_df = sample_rows(df, minimal)
 
     return subsampled_df
+
+
+def get_N50(lengths):
+    """Return the read length N50 without sorting the full array.
+
+    Equivalent to nanomath.get_N50 on the sorted lengths, but narrows down on the read
+    at which the cumulative length crosses half of the total using np.partition,
+    which is O(n) rather than O(n log n).
+    """
+    remaining = np.asarray(lengths)
+    target = 0.5 * remaining.sum()
+    below = 0
+    while remaining.size > 1:
+        k = remaining.size // 2
+        part = np.partition(remaining, k)
+        lower = below + part[:k].sum()
+        if lower >= target:
+            remaining = part[:k]
+        elif lower + part[k] >= target:
+            return part[k]
+        else:
+            below = lower + part[k]
+            remaining = part[k + 1 :]
+    return remaining[0]
+
+
+def lower_percentile(values, q):
+    """Return the q-th percentile of values without interpolation (numpy's "lower").
+
+    Uses a single np.partition on a float32 copy, O(n) instead of a full sort.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    k = int(q / 100 * (values.size - 1))
+    return np.partition(values, k)[k]
+
+
+def pearsonr(x, y):
+    """Return Pearson's correlation coefficient of x and y and its two-sided p-value.
+
+    Equivalent to scipy.stats.pearsonr, but the sums are taken in float32 over the centered
+    values, which is plenty precise for annotating a plot.
+    """
+    from scipy.stats import t
+
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    xm = x - x.mean()
+    ym = y - y.mean()
+    r = float(np.dot(xm, ym) / np.sqrt(np.dot(xm, xm) * np.dot(ym, ym)))
+    r = max(min(r, 1.0), -1.0)
+    df = x.size - 2
+    tstat = abs(r) * np.sqrt(df / (1 - r * r)) if r * r < 1 else np.inf
+    return r, float(2 * t.sf(tstat, df))
+
+
+def reduce_memory_usage(df, keep_precision=False):
+    """Narrow the dtypes of columns that are needlessly wide for their content.
+
+    Repeated strings (barcodes, dataset names) become categoricals. Unless keep_precision,
+    lengths become int32, mapping qualities int16, channel numbers uint16 and
+    qualities and identities float32.
+    """
+    for col in ["barcode", "dataset"]:
+        if col in df and df[col].dtype != "category":
+            df[col] = df[col].astype("category")
+    if keep_precision or not len(df):
+        return df
+    for col, dtype in [
+        ("lengths", np.int32),
+        ("aligned_lengths", np.int32),
+        ("mapQ", np.int16),
+        ("channelIDs", np.uint16),
+    ]:
+        if col in df and df[col].dtype.kind in "iu" and df[col].dtype.itemsize > 2:
+            info = np.iinfo(dtype)
+            if df[col].min() >= info.min and df[col].max() <= info.max:
+                df[col] = df[col].astype(dtype)
+    for col in ["quals", "aligned_quals", "percentIdentity"]:
+        if col in df and df[col].dtype == np.float64:
+            df[col] = df[col].astype(np.float32)
+    return df
+
+
+def cache_path(outdir, source, files, **options):
+    """Return the path of the parquet cache for these input files.
+
+    The key covers the absolute path, size and modification time of every file, the
+    options passed to nanoget and the NanoPlot and nanoget versions, so that changed input
+    or extraction never hits a stale cache. Returns None if an input is not a regular file
+    (e.g. a stream).
+    """
+    from importlib.metadata import version  # rather than importing nanoget on a cache hit
+
+    if not all(os.path.isfile(f) for f in files):
+        return None
+    fingerprint = [(os.path.abspath(f), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files]
+    key = repr((source, fingerprint, sorted(options.items()), __version__, version("nanoget")))
+    digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    return os.path.join(outdir, ".nanoplot_cache", digest + ".parquet")
+
+
+def write_cache(df, cachefile):
+    """Write df to the parquet cache, renaming it in place only once it is complete."""
+    partial = None
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        # a file of its own, so that runs sharing an output directory never rename each other's
+        handle, partial = tempfile.mkstemp(dir=os.path.dirname(cachefile), suffix=".part")
+        os.close(handle)
+        df.to_parquet(partial, compression="zstd", engine="pyarrow")
+        os.replace(partial, cachefile)
+        logging.info(f"Cached extracted data in {cachefile}")
+    except (ImportError, ValueError, TypeError, NotImplementedError, OSError) as e:
+        if partial and os.path.exists(partial):
+            os.remove(partial)
+        logging.warning("Extracted data could not be cached:")
+        logging.warning(e)
+
+
+def write_tsv_gz(df, outfile, threads=1):
+    """Write df as a gzip compressed tsv file.
+
+    Compression is piped through pigz when available, which compresses on multiple
+    threads while pandas formats the text. Otherwise pandas compresses with gzip.
+    """
+    pigz = shutil.which("pigz")
+    if not pigz:
+        df.to_csv(outfile, sep="\t", index=False, compression="gzip")
+        return
+    with open(outfile, "wb") as handle:
+        proc = subprocess.Popen(
+            [pigz, "-c", "-p", str(threads)], stdin=subprocess.PIPE, stdout=handle
+        )
+        try:
+            with io.TextIOWrapper(proc.stdin, encoding="utf-8", newline="") as text:
+                df.to_csv(text, sep="\t", index=False)
+        finally:
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
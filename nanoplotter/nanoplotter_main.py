@@ -32,7 +32,6 @@ import pandas as pd
 import numpy as np
 from nanoplotter.plot import Plot
 import plotly.express as px
-import plotly.figure_factory as ff
 from nanoplotter.spatial_heatmap import spatial_heatmap
 from nanoplotter.timeplots import time_plots
 import re
@@ -100,11 +99,12 @@ def scatter(
     - hexbin not implemented yet
     - pauvre plot temporarily not available
     """
+    x, y = np.asarray(x), np.asarray(y)
     logging.info(f"NanoPlot: Creating {names[0]} vs {names[1]} plots using {x.size} reads.")
     if not contains_variance([x, y], names):
         return []
     plots_made = []
-    idx = np.random.choice(x.index, min(10000, len(x)), replace=False)
+    idx = np.random.choice(len(x), min(10000, len(x)), replace=False)
     maxvalx = xmax or np.amax(x[idx])
     maxvaly = ymax or np.amax(y[idx])
 
@@ -148,6 +148,8 @@ def scatter(
         plots_made.append(dot_plot)
 
     if plots["kde"]:
+        import plotly.figure_factory as ff  # slow to import and only needed here
+
         kde_plot = Plot(
             path=path + "_loglength_kde.html" if log else path + "_kde.html",
             title=f"{names[0]} vs {names[1]} kde plot",
@@ -318,7 +320,7 @@ def scatter_legacy(
 
     if plots["kde"]:
         if len(x) > 2:
-            idx = np.random.choice(x.index, min(2000, len(x)), replace=False)
+            idx = np.random.choice(len(x), min(2000, len(x)), replace=False)
             if log:
                 kde_plot = Plot(
                     path=path + "_loglength_kde." + figformat[0],
@@ -399,9 +401,34 @@ def contains_variance(arrays, names):
         return True
 
 
+def uniform_histograms(array, bins, weights):
+    """Histograms of array in the same uniform bins spanning its range, as np.histogram makes them.
+
+    One histogram is returned for each entry of weights, None giving the number of values.
+    The bin of each value is computed once and counted for every histogram.
+    """
+    array = np.asarray(array)
+    low, high = float(array.min()), float(array.max())
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    bin_edges = np.linspace(low, high, bins + 1)
+    idx = ((array - low) * (bins / (high - low))).astype(np.intp)
+    np.minimum(idx, bins - 1, out=idx)
+    # correct for rounding at the edges, as np.histogram does, the last bin includes the maximum
+    upper_edges = np.append(bin_edges[1:-1], np.inf)
+    idx -= array < bin_edges[idx]
+    idx += array >= upper_edges[idx]
+    hists = [np.bincount(idx, weights=w, minlength=bins) for w in weights]
+    return [
+        hist.astype(np.int64 if w is None else np.asarray(w).dtype, copy=False)
+        for hist, w in zip(hists, weights)
+    ], bin_edges
+
+
 def length_plots(array, name, path, settings, title=None, n50=None, color="#4CB391"):
     """Create histogram of normal and log transformed read lengths."""
     logging.info("NanoPlot:  Creating length plots for {}.".format(name))
+    array = np.asarray(array)
     maxvalx = np.amax(array)
     if n50:
         logging.info(
@@ -415,11 +442,16 @@ def length_plots(array, name, path, settings, title=None, n50=None, color="#4CB3
     plots = []
 
     HistType = [
-        {"weight": array, "name": "Weighted", "ylabel": "Number of bases"},
-        {"weight": None, "name": "Non weighted", "ylabel": "Number of reads"},
+        {"name": "Weighted", "ylabel": "Number of bases"},
+        {"name": "Non weighted", "ylabel": "Number of reads"},
     ]
 
-    for h_type in HistType:
+    bins = max(round(int(maxvalx) / 500), 10)
+    log_array = np.log10(array)
+    hists, bin_edges = uniform_histograms(array, bins, weights=[array, None])
+    hists_log, bin_edges_log = uniform_histograms(log_array, bins, weights=[log_array, None])
+
+    for h_type, hist, hist_log in zip(HistType, hists, hists_log):
         histogram = Plot(
             path=path
             + h_type["name"].replace(" ", "_")
@@ -429,10 +461,6 @@ def length_plots(array, name, path, settings, title=None, n50=None, color="#4CB3
             title=f"{h_type['name']} histogram of read lengths",
         )
 
-        hist, bin_edges = np.histogram(
-            array, bins=max(round(int(maxvalx) / 500), 10), weights=h_type["weight"]
-        )
-
         fig = go.Figure()
 
         fig.add_trace(go.Bar(x=bin_edges[1:], y=hist, marker_color=color))
@@ -462,18 +490,6 @@ def length_plots(array, name, path, settings, title=None, n50=None, color="#4CB3
             title=h_type["name"] + " histogram of read lengths after log transformation",
         )
 
-        if h_type["weight"] is None:
-            hist_log, bin_edges_log = np.histogram(
-                np.log10(array), bins=max(round(int(maxvalx) / 500), 10), weights=h_type["weight"]
-            )
-
-        else:
-            hist_log, bin_edges_log = np.histogram(
-                np.log10(array),
-                bins=max(round(int(maxvalx) / 500), 10),
-                weights=np.log10(h_type["weight"]),
-            )
-
         fig = go.Figure()
         fig.add_trace(
             go.Bar(
@@ -526,7 +542,7 @@ def dynamic_histogram(array, name, path, settings, title=None, color="#4CB391"):
     )
     ylabel = "Number of reads" if len(array) <= 10000 else "Downsampled number of reads"
     dynhist.html, dynhist.fig = plotly_histogram(
-        array=array.sample(min(len(array), 10000)),
+        array=np.random.choice(np.asarray(array), min(len(array), 10000), replace=False),
         color=color,
         title=title or dynhist.title,
         xlabel=name,
@@ -557,11 +573,11 @@ def plotly_histogram(array, color="#4CB391", title=None, xlabel=None, ylabel=Non
 def yield_by_minimal_length_plot(array, name, path, settings, title=None, color="#4CB391"):
     df = pd.DataFrame(data={"lengths": np.sort(array)[::-1]})
     df["cumyield_gb"] = df["lengths"].cumsum() / 10**9
-    idx = np.random.choice(array.index, min(10000, len(array)), replace=False)
+    idx = np.random.choice(len(array), min(10000, len(array)), replace=False)
 
     yield_by_length = Plot(path=path + "Yield_By_Length.html", title="Yield by length")
 
-    fig = px.scatter(df, x=df.reindex(idx)["lengths"], y=df.reindex(idx)["cumyield_gb"])
+    fig = px.scatter(df, x=df.iloc[idx]["lengths"], y=df.iloc[idx]["cumyield_gb"])
     fig.update_traces(marker=dict(color=color))
     fig.update_layout(
         xaxis_title="Read length",
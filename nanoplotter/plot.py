@@ -3,7 +3,6 @@ from base64 import b64encode
 from io import BytesIO
 from urllib.parse import quote as urlquote
 import sys
-from kaleido.scopes.plotly import PlotlyScope
 import logging
 
 
@@ -11,6 +10,8 @@ class Plot(object):
     """A Plot object is defined by a path to the output file and the title of the plot."""
 
     only_report = False
+    scope = None  # kaleido scope, started for the first static export and reused by later plots
+    scope_pid = None
     
     def __init__(self, path, title):
         self.path = path
@@ -77,9 +78,13 @@ class Plot(object):
             sys.stderr.write(".show not implemented for Plot instance without fig attribute!")
 
     def save_static(self, figformat):
-        scope = PlotlyScope()
+        if Plot.scope is None or Plot.scope_pid != os.getpid():
+            from kaleido.scopes.plotly import PlotlyScope
+
+            # a forked plotting process starts its own kaleido rather than sharing the parent's
+            Plot.scope, Plot.scope_pid = PlotlyScope(), os.getpid()
         with open(self.path.replace("html", figformat), "wb") as f:
-            f.write(scope.transform(self.fig, format=figformat))
+            f.write(Plot.scope.transform(self.fig, format=figformat))
             logging.info(
                 f"Saved {self.path.replace('.html', '')}  as {figformat} (or png for --legacy)"
             )
@@ -63,21 +63,27 @@ def make_layout(maxval):
             flowcell='PromethION')
 
 
-def spatial_heatmap(array, path, colormap, settings, title=None):
-    """Taking channel information and creating post run channel activity plots."""
+def spatial_heatmap(array, path, colormap, settings, title=None, counts=None):
+    """Taking channel information and creating post run channel activity plots.
+
+    Instead of the channel of each read, the number of reads per channel can be passed as counts.
+    """
+    if counts is None:
+        counts = np.bincount(np.asarray(array).astype(np.intp, copy=False))
     logging.info("Nanoplotter: Creating heatmap of reads per channel using {} reads."
-                 .format(array.size))
+                 .format(counts.sum()))
 
     activity_map = Plot(
         path=path + ".html",
         title="Number of reads generated per channel")
 
-    layout = make_layout(maxval=np.amax(array))
-    valueCounts = pd.value_counts(pd.Series(array))
+    layout = make_layout(maxval=counts.size - 1)
 
-    for entry in valueCounts.keys():
-        layout.template[np.where(layout.structure == entry)
-                        ] = valueCounts[entry]
+    # look up the count of every position on the flowcell, channel 0 marks an empty position
+    lookup = np.zeros(layout.structure.max() + 1, dtype=layout.template.dtype)
+    known = min(counts.size, lookup.size)
+    lookup[1:known] = counts[1:known]
+    layout.template = lookup[layout.structure]
 
     data = pd.DataFrame(layout.template, index=layout.yticks,
                         columns=layout.xticks)
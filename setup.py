@@ -35,7 +35,7 @@ setup(
         "biopython",
         "pysam>0.10.0.0",
         "pandas>=1.1.0",
-        "numpy>=1.16.5",
+        "numpy>=1.17.0",
         "scipy",
         "python-dateutil",
         "nanoget>=1.19.1",